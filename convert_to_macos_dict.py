@@ -10,20 +10,52 @@ macOS Dictionary uses Apple Dictionary Development Kit format:
 
 import os
 import re
-import html
+import shutil
 from pathlib import Path
 from readmdict import MDX
 
+# One entry of Dictionary.xml as UTF-8 bytes, filled in with a single
+# %-format per entry; the optional lowercase index line is pre-rendered
+ENTRY_TEMPLATE = (
+    b'<d:entry id="entry_%d_%b" d:title="%b">\n'
+    b'  <d:index d:value="%b"/>\n'
+    b'%b'
+    b'  <h1>%b</h1>\n'
+    b'  <div class="definition">%b</div>\n'
+    b'</d:entry>\n\n'
+)
+LOWER_INDEX_TEMPLATE = b'  <d:index d:value="%b"/>\n'
+
+# Number of rendered entries buffered before each write
+WRITE_BATCH = 4096
+
+# Patterns used on every entry, compiled once
+LINK_TAG_RE = re.compile(r'<link[^>]*>')
+MDX_LINK_RE = re.compile(r'@@@LINK=([^<\n]+)')
+ID_UNSAFE_RE = re.compile(r'[^a-zA-Z0-9_-]')
+
+# Same replacements as html.escape(quote=True), applied in a single pass
+XML_ESCAPE_TABLE = str.maketrans({
+    '&': '&amp;',
+    '<': '&lt;',
+    '>': '&gt;',
+    '"': '&quot;',
+    "'": '&#x27;',
+})
+
 def clean_html(content: str) -> str:
     """Clean and normalize HTML content for macOS Dictionary."""
-    # Remove MDict-specific tags
-    content = re.sub(r'<link[^>]*>', '', content)
-    content = re.sub(r'@@@LINK=([^<\n]+)', r'<a href="x-dictionary:r:\1">\1</a>', content)
+    # Remove MDict-specific tags; the substring checks skip the regex
+    # passes for the common entry that has neither
+    if '<link' in content:
+        content = LINK_TAG_RE.sub('', content)
+    if '@@@LINK=' in content:
+        content = MDX_LINK_RE.sub(r'<a href="x-dictionary:r:\1">\1</a>', content)
     return content
 
 def escape_xml(text: str) -> str:
     """Escape special XML characters."""
-    return html.escape(text, quote=True)
+    return text.translate(XML_ESCAPE_TABLE)
 
 def convert_mdx_to_apple_dict(mdx_path: str, output_dir: str = "AppleDict"):
     """Convert MDX file to Apple Dictionary XML format."""
@@ -31,14 +63,6 @@ def convert_mdx_to_apple_dict(mdx_path: str, output_dir: str = "AppleDict"):
     print(f"Reading {mdx_path}...")
     mdx = MDX(mdx_path)
 
-    # Get all entries
-    items = mdx.items()
-    entries = [(key.decode('utf-8') if isinstance(key, bytes) else key,
-                val.decode('utf-8') if isinstance(val, bytes) else val)
-               for key, val in items]
-
-    print(f"Found {len(entries)} entries")
-
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
 
@@ -46,37 +70,49 @@ def convert_mdx_to_apple_dict(mdx_path: str, output_dir: str = "AppleDict"):
     xml_path = Path(output_dir) / "Dictionary.xml"
     print(f"Writing {xml_path}...")
 
-    with open(xml_path, 'w', encoding='utf-8') as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write('<d:dictionary xmlns="http://www.w3.org/1999/xhtml" ')
-        f.write('xmlns:d="http://www.apple.com/DTDs/DictionaryService-1.0.rng">\n\n')
-
-        for i, (word, definition) in enumerate(entries):
+    with open(xml_path, 'wb', buffering=1 << 20) as f:
+        f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write(b'<d:dictionary xmlns="http://www.w3.org/1999/xhtml" ')
+        f.write(b'xmlns:d="http://www.apple.com/DTDs/DictionaryService-1.0.rng">\n\n')
+
+        # Entries are decoded as they are read, so nothing is held beyond the batch
+        buf = []
+        count = 0
+        for i, (key, val) in enumerate(mdx.items()):
+            word = key.decode('utf-8') if type(key) is bytes else key
+            definition = val.decode('utf-8') if type(val) is bytes else val
+            count = i + 1
             if not word or not definition:
                 continue
 
-            # Create entry ID (sanitized)
-            entry_id = re.sub(r'[^a-zA-Z0-9_-]', '_', word)[:50]
-            entry_id = f"entry_{i}_{entry_id}"
+            # Create entry ID suffix (sanitized, always ASCII)
+            entry_id = ID_UNSAFE_RE.sub('_', word)[:50].encode('ascii')
 
             # Clean definition HTML
-            clean_def = clean_html(definition)
-
-            f.write(f'<d:entry id="{entry_id}" d:title="{escape_xml(word)}">\n')
-            f.write(f'  <d:index d:value="{escape_xml(word)}"/>\n')
+            clean_def = clean_html(definition).encode('utf-8')
 
             # Add lowercase index if different
-            if word.lower() != word:
-                f.write(f'  <d:index d:value="{escape_xml(word.lower())}"/>\n')
+            lower_word = word.lower()
+            if lower_word != word:
+                extra_index = LOWER_INDEX_TEMPLATE % escape_xml(lower_word).encode('utf-8')
+            else:
+                extra_index = b''
+
+            # Encode once and reuse for the title, index and heading
+            escaped_word = escape_xml(word).encode('utf-8')
+            buf.append(ENTRY_TEMPLATE % (i, entry_id, escaped_word, escaped_word,
+                                         extra_index, escaped_word, clean_def))
+            if len(buf) >= WRITE_BATCH:
+                f.write(b''.join(buf))
+                buf.clear()
 
-            f.write(f'  <h1>{escape_xml(word)}</h1>\n')
-            f.write(f'  <div class="definition">{clean_def}</div>\n')
-            f.write('</d:entry>\n\n')
+            if not count & 4095:
+                print(f"  Processed {count} entries...")
 
-            if (i + 1) % 5000 == 0:
-                print(f"  Processed {i + 1} entries...")
+        f.write(b''.join(buf))
+        f.write(b'</d:dictionary>\n')
 
-        f.write('</d:dictionary>\n')
+    print(f"Found {count} entries")
 
     # Write DictInfo.plist
     plist_path = Path(output_dir) / "DictInfo.plist"
@@ -147,8 +183,7 @@ clean:
     # Copy original CSS if exists
     orig_css = Path(mdx_path).with_suffix('.css')
     if orig_css.exists():
-        with open(orig_css, 'r', encoding='utf-8') as src:
-            css_content = src.read()
+        shutil.copyfile(orig_css, css_path)
     else:
         css_content = '''
 /* Default styles for Etymonline dictionary */
@@ -157,9 +192,8 @@ h1 { font-size: 1.2em; font-weight: bold; color: #333; }
 a { color: #0066cc; text-decoration: none; }
 a:hover { text-decoration: underline; }
 '''
-
-    with open(css_path, 'w', encoding='utf-8') as f:
-        f.write(css_content)
+        with open(css_path, 'w', encoding='utf-8') as f:
+            f.write(css_content)
 
     print(f"\nConversion complete!")
     print(f"\nNext steps:")